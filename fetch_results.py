@@ -4,10 +4,14 @@ Fetch weekly running club results
 """
 
 import csv
+import logging
 import re
 import os
+from contextlib import contextmanager
 from datetime import datetime
-from html import unescape
+from functools import lru_cache
+
+from selectolax.lexbor import LexborHTMLParser
 
 # Configuration - reads from environment variables for privacy
 # Set these as GitHub Actions secrets, or export locally for testing
@@ -16,19 +20,29 @@ CLUB_NAME = os.environ.get('CLUB_NAME', '')
 BASE_URL = os.environ.get('DATA_URL', '')
 OUTPUT_FILE = 'club_results.csv'
 
-if not all([CLUB_NUM, CLUB_NAME, BASE_URL]):
-    raise ValueError("Missing required environment variables: CLUB_NUM, CLUB_NAME, DATA_URL")
+logger = logging.getLogger(__name__)
 
+# Patterns used on every parsed page
+_DATE_RE = re.compile(r'who participated at a parkrun on (\d{4}-\d{2}-\d{2})')
+_PARKRUN_SUFFIX = re.compile(r' parkrun$', re.IGNORECASE)
 
-def fetch_html(event_date=None):
-    """Fetch the consolidated club report HTML using Playwright"""
-    from playwright.sync_api import sync_playwright
+# Club name case-folded once for the per-row membership check
+_CLUB_NEEDLE = CLUB_NAME.casefold()
 
-    url = f"{BASE_URL}?clubNum={CLUB_NUM}"
-    if event_date:
-        url += f"&eventdate={event_date}"
 
-    print(f"Fetching: {url}")
+def check_config():
+    """Fail early if the required environment variables are not set"""
+    # Only lengths are logged so secrets never end up in CI output
+    logger.debug("Config lengths: CLUB_NUM=%d CLUB_NAME=%d DATA_URL=%d",
+                 len(CLUB_NUM), len(CLUB_NAME), len(BASE_URL))
+    if not all([CLUB_NUM, CLUB_NAME, BASE_URL]):
+        raise ValueError("Missing required environment variables: CLUB_NUM, CLUB_NAME, DATA_URL")
+
+
+@contextmanager
+def open_browser():
+    """Launch a headless browser and yield a page that can be reused across fetches"""
+    from playwright.sync_api import sync_playwright
 
     with sync_playwright() as p:
         # Launch with stealth settings
@@ -41,83 +55,103 @@ def fetch_html(event_date=None):
             ]
         )
 
-        # Create context with realistic settings
-        context = browser.new_context(
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            viewport={'width': 1920, 'height': 1080},
-            locale='en-GB',
-        )
+        try:
+            # Create context with realistic settings
+            context = browser.new_context(
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                viewport={'width': 1920, 'height': 1080},
+                locale='en-GB',
+            )
 
-        page = context.new_page()
+            page = context.new_page()
 
-        # Remove webdriver property
-        page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-        """)
+            # Remove webdriver property
+            page.add_init_script("""
+                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+            """)
 
-        page.goto(url, wait_until='networkidle')
+            yield page
+        finally:
+            browser.close()
 
-        # Wait for the results table to appear
-        try:
-            page.wait_for_selector('h2', timeout=15000)
-        except:
-            print("Warning: No h2 elements found after waiting")
 
-        html = page.content()
-        browser.close()
+def fetch_html(event_date=None, page=None):
+    """Fetch the consolidated club report HTML using Playwright
+
+    Pass a page from open_browser() to reuse the same browser (and its
+    open connections) across several fetches.
+    """
+    if page is None:
+        with open_browser() as page:
+            return fetch_html(event_date, page)
 
-    print(f"Got {len(html)} characters")
+    url = f"{BASE_URL}?clubNum={CLUB_NUM}"
+    if event_date:
+        url += f"&eventdate={event_date}"
+
+    logger.info("Fetching: %s", url)
+
+    page.goto(url, wait_until='networkidle')
+
+    # Wait for the results table to appear
+    try:
+        page.wait_for_selector('h2', timeout=15000)
+    except:
+        logger.warning("Warning: No h2 elements found after waiting")
+
+    # Only the body holds the report; skipping the head avoids serializing
+    # and re-scanning inline scripts and styles
+    html = page.inner_html('body')
+
+    logger.info("Got %d characters", len(html))
     return html
 
 
+@lru_cache(maxsize=4096)
 def clean_text(text):
-    """Remove HTML tags and decode entities"""
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-    # Decode HTML entities
-    text = unescape(text)
-    # Normalize whitespace
-    text = ' '.join(text.split())
-    return text.strip()
+    """Normalize whitespace in text extracted from the parsed HTML"""
+    return ' '.join(text.split())
+
+
+def count_rows(columns):
+    """Number of results held in a columns dict from parse_results"""
+    return len(columns['Date'])
 
 
 def parse_results(html):
-    """Parse the HTML and extract Westbourne RC results"""
-    results = []
+    """Parse the HTML and extract Westbourne RC results
+
+    Results are returned column-wise as a dict of equal-length lists keyed by
+    column name, e.g. columns['parkrunner'][i] is the runner of result i.
+    """
+    columns = {'Date': [], 'Event': []}
 
     # Extract event date
-    date_match = re.search(r'who participated at a parkrun on (\d{4}-\d{2}-\d{2})', html)
+    date_match = _DATE_RE.search(html)
     event_date = date_match.group(1) if date_match else datetime.now().strftime('%Y-%m-%d')
-    print(f"Event date: {event_date}")
-
-    # Split by h2 headers to get each parkrun event
-    sections = re.split(r'<h2>', html, flags=re.IGNORECASE)
-
-    for section in sections[1:]:  # Skip first section (before any h2)
-        # Extract event name
-        h2_match = re.match(r'^([^<]+)</h2>', section, re.IGNORECASE)
-        if not h2_match:
+    logger.info("Event date: %s", event_date)
+
+    tree = LexborHTMLParser(html)
+
+    # Walk h2 headers and tables in document order; each parkrun event is an
+    # h2 followed by its results table
+    event_name = None
+    for node in tree.css('h2, table'):
+        if node.tag == 'h2':
+            event_name = clean_text(node.text())
+            # Remove " parkrun" suffix for cleaner display
+            event_name = _PARKRUN_SUFFIX.sub('', event_name)
             continue
 
-        event_name = h2_match.group(1).strip()
-        # Remove " parkrun" suffix for cleaner display
-        event_name = re.sub(r' parkrun$', '', event_name, flags=re.IGNORECASE)
-
-        # Find table in this section
-        table_match = re.search(r'<table[^>]*>(.*?)</table>', section, re.IGNORECASE | re.DOTALL)
-        if not table_match:
+        # Only the first table after each h2 belongs to that event
+        if event_name is None:
             continue
 
-        table_html = table_match.group(1)
-
-        # Extract rows
-        rows = re.findall(r'<tr[^>]*>(.*?)</tr>', table_html, re.IGNORECASE | re.DOTALL)
-
         headers = []
-        for i, row in enumerate(rows):
+        section_count = 0
+        for i, row in enumerate(node.css('tr')):
             # Extract cells (th or td)
-            cells = re.findall(r'<t[hd][^>]*>(.*?)</t[hd]>', row, re.IGNORECASE | re.DOTALL)
-            cells = [clean_text(c) for c in cells]
+            cells = [clean_text(c.text()) for c in row.css('th, td')]
 
             if not cells:
                 continue
@@ -135,14 +169,25 @@ def parse_results(html):
 
             # Only include club members
             club = row_data.get('Club', '')
-            if CLUB_NAME.lower() in club.lower():
+            if _CLUB_NEEDLE in club.casefold():
                 row_data['Event'] = event_name
                 row_data['Date'] = event_date
-                results.append(row_data)
 
-        print(f"  {event_name}: found {len([r for r in results if r['Event'] == event_name])} club members")
+                # Add to the columns, padding any this row doesn't have
+                count = count_rows(columns)
+                for header, cell in row_data.items():
+                    if header not in columns:
+                        columns[header] = [''] * count
+                    columns[header].append(cell)
+                for column in columns.values():
+                    if len(column) == count:
+                        column.append('')
+                section_count += 1
 
-    return results
+        logger.info("  %s: found %d club members", event_name, section_count)
+        event_name = None
+
+    return columns
 
 
 def load_existing_results():
@@ -158,62 +203,88 @@ def load_existing_results():
     return existing
 
 
-def save_results(results, append=True):
-    """Save results to CSV file"""
-    if not results:
-        print("No results to save")
+class ResultsWriter:
+    """Keep the results CSV open so several batches can be appended to it"""
+
+    def __init__(self, append=True):
+        self.append = append
+        self.file = None
+        self.needs_header = False
+
+    def __enter__(self):
+        mode = 'a' if self.append else 'w'
+        self.file = open(OUTPUT_FILE, mode, newline='', encoding='utf-8')
+        # Only a new (or empty) file needs the header row
+        self.needs_header = self.file.tell() == 0
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+
+    def write_rows(self, rows, fieldnames):
+        """Write row tuples already laid out in fieldnames order"""
+        writer = csv.writer(self.file)
+        if self.needs_header:
+            writer.writerow(fieldnames)
+            self.needs_header = False
+        writer.writerows(rows)
+
+
+def save_results(results, append=True, existing=None, writer=None):
+    """Save results (columns from parse_results) to CSV file"""
+    count = count_rows(results)
+    if not count:
+        logger.info("No results to save")
         return
 
     # Define column order
     fieldnames = ['Date', 'Event', 'Position', 'Gender Position', 'parkrunner', 'Club', 'Time']
 
     # Check for any extra columns
-    all_keys = set()
-    for r in results:
-        all_keys.update(r.keys())
-    extra_keys = sorted(all_keys - set(fieldnames))
+    extra_keys = sorted(set(results) - set(fieldnames))
     fieldnames.extend(extra_keys)
 
-    # Load existing to avoid duplicates
-    existing = load_existing_results() if append else set()
+    # Load existing to avoid duplicates. Callers saving several batches pass
+    # the same set in, which is kept up to date with the keys written below
+    if existing is None:
+        existing = load_existing_results() if append else set()
 
     # Filter out duplicates
-    new_results = []
-    for r in results:
-        key = (r.get('Date', ''), r.get('Event', ''), r.get('parkrunner', ''))
-        if key not in existing:
-            new_results.append(r)
-
-    if not new_results:
-        print("No new results to add (all duplicates)")
+    blank = [''] * count
+    keys = zip(results['Date'], results['Event'], results.get('parkrunner', blank))
+    rows = zip(*[results.get(fn, blank) for fn in fieldnames])
+    new = [(key, row) for key, row in zip(keys, rows) if key not in existing]
+
+    if not new:
+        logger.info("No new results to add (all duplicates)")
         return
 
-    # Write to CSV (append new results to end)
-    file_exists = os.path.exists(OUTPUT_FILE) and append
-    mode = 'a' if file_exists else 'w'
+    new_keys, new_rows = zip(*new)
 
-    with open(OUTPUT_FILE, mode, newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerows(new_results)
+    # Write to CSV (append new results to end)
+    if writer is None:
+        with ResultsWriter(append) as writer:
+            writer.write_rows(new_rows, fieldnames)
+    else:
+        writer.write_rows(new_rows, fieldnames)
 
-    print(f"Saved {len(new_results)} new results to {OUTPUT_FILE}")
+    existing.update(new_keys)
+    logger.info("Saved %d new results to %s", len(new_rows), OUTPUT_FILE)
 
 
-def fetch_single_week(event_date=None):
+def fetch_single_week(event_date=None, page=None, existing=None, writer=None):
     """Fetch and save results for a single week"""
     try:
-        html = fetch_html(event_date)
+        html = fetch_html(event_date, page)
         results = parse_results(html)
-        print(f"Total club results: {len(results)}")
+        logger.info("Total club results: %d", count_rows(results))
 
-        if results:
-            save_results(results, append=True)
+        if count_rows(results):
+            save_results(results, append=True, existing=existing, writer=writer)
         return results
 
     except Exception as e:
-        print(f"Error fetching data: {e}")
+        logger.error("Error fetching data: %s", e)
         raise
 
 
@@ -222,76 +293,95 @@ def backfill_weeks(num_weeks=4, sleep_seconds=30):
     import time
     from datetime import timedelta
 
-    print(f"Backfilling {num_weeks} weeks of historical data")
-    print(f"Using {sleep_seconds}s delay between requests to be respectful")
-    print("=" * 50)
-
-    # First, get the latest page to find the most recent date
-    html = fetch_html()
-    date_match = re.search(r'who participated at a parkrun on (\d{4}-\d{2}-\d{2})', html)
-
-    if not date_match:
-        print("Could not find event date in page")
-        return
-
-    latest_date = datetime.strptime(date_match.group(1), '%Y-%m-%d')
-    print(f"Most recent results: {latest_date.strftime('%Y-%m-%d')}")
+    logger.info("Backfilling %d weeks of historical data", num_weeks)
+    logger.info("Using %ss delay between requests to be respectful", sleep_seconds)
+    logger.info("=" * 50)
 
-    # Parse and save the latest week first
-    results = parse_results(html)
-    print(f"Week {latest_date.strftime('%Y-%m-%d')}: {len(results)} results")
-    save_results(results, append=True)
+    # Reuse one browser session and one open CSV for every week rather than
+    # relaunching and reopening per fetch
+    with open_browser() as page, ResultsWriter() as writer:
+        # First, get the latest page to find the most recent date. Request
+        # start times are tracked so the delay is measured start-to-start and
+        # time spent fetching, parsing and saving counts towards it
+        last_request = time.monotonic()
+        html = fetch_html(page=page)
+        date_match = _DATE_RE.search(html)
 
-    # Now fetch previous weeks
-    for i in range(1, num_weeks):
-        print(f"\nSleeping {sleep_seconds}s before next request...")
-        time.sleep(sleep_seconds)
+        if not date_match:
+            logger.error("Could not find event date in page")
+            return
 
-        # Go back 7 days
-        prev_date = latest_date - timedelta(days=7 * i)
-        date_str = prev_date.strftime('%Y-%m-%d')
+        latest_date = datetime.strptime(date_match.group(1), '%Y-%m-%d')
+        logger.info("Most recent results: %s", latest_date.strftime('%Y-%m-%d'))
 
-        print(f"\nFetching week {i+1}/{num_weeks}: {date_str}")
-        print("-" * 40)
+        # Load saved keys once; save_results keeps the set up to date
+        existing = load_existing_results()
 
-        try:
-            html = fetch_html(date_str)
-            results = parse_results(html)
-            print(f"Week {date_str}: {len(results)} results")
-            save_results(results, append=True)
-        except Exception as e:
-            print(f"Error fetching {date_str}: {e}")
-            continue
+        # Parse and save the latest week first
+        results = parse_results(html)
+        logger.info("Week %s: %d results", latest_date.strftime('%Y-%m-%d'), count_rows(results))
+        save_results(results, append=True, existing=existing, writer=writer)
+
+        # Now fetch previous weeks
+        for i in range(1, num_weeks):
+            wait = sleep_seconds - (time.monotonic() - last_request)
+            if wait > 0:
+                logger.info("\nSleeping %.0fs before next request...", wait)
+                time.sleep(wait)
+
+            # Go back 7 days
+            prev_date = latest_date - timedelta(days=7 * i)
+            date_str = prev_date.strftime('%Y-%m-%d')
+
+            logger.info("\nFetching week %d/%d: %s", i + 1, num_weeks, date_str)
+            logger.info("-" * 40)
+
+            try:
+                last_request = time.monotonic()
+                html = fetch_html(date_str, page)
+                results = parse_results(html)
+                logger.info("Week %s: %d results", date_str, count_rows(results))
+                save_results(results, append=True, existing=existing, writer=writer)
+            except Exception as e:
+                logger.error("Error fetching %s: %s", date_str, e)
+                continue
 
-    print("\n" + "=" * 50)
-    print("Backfill complete!")
+    logger.info("\n" + "=" * 50)
+    logger.info("Backfill complete!")
 
 
 def main():
     """Main entry point"""
-    print(f"Fetching results for club {CLUB_NUM} ({CLUB_NAME})")
-    print("=" * 50)
+    logger.info("Fetching results for club %s (%s)", CLUB_NUM, CLUB_NAME)
+    logger.info("=" * 50)
 
     try:
         html = fetch_html()
         results = parse_results(html)
-        print(f"\nTotal club results: {len(results)}")
+        logger.info("\nTotal club results: %d", count_rows(results))
 
-        if results:
+        if count_rows(results):
             save_results(results, append=True)
 
-            # Print summary
-            print("\nResults summary:")
-            for r in results:
-                print(f"  {r['Date']} | {r['Event']:20} | {r['parkrunner']:20} | {r['Time']}")
+            # Per-runner summary is only shown with WESTBOURNE_DEBUG set
+            logger.debug("\nResults summary:")
+            for row in zip(results['Date'], results['Event'],
+                           results['parkrunner'], results['Time']):
+                logger.debug("  %s | %-20s | %-20s | %s", *row)
 
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
         raise
 
 
 if __name__ == '__main__':
     import sys
+    # Set WESTBOURNE_DEBUG to also log per-runner detail
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get('WESTBOURNE_DEBUG') else logging.INFO,
+        format='%(message)s',
+    )
+    check_config()
     if len(sys.argv) > 1 and sys.argv[1] == '--backfill':
         weeks = int(sys.argv[2]) if len(sys.argv) > 2 else 4
         backfill_weeks(num_weeks=weeks, sleep_seconds=30)